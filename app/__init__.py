@@ -3,15 +3,34 @@ import os
 
 from flask import Flask
 from flask_bcrypt import Bcrypt
+from flask_caching import Cache
 from flask_login import LoginManager
 from flask_migrate import Migrate
+from flask_session import Session
 from flask_sqlalchemy import SQLAlchemy
+from redis import Redis
+from whitenoise import WhiteNoise
 
+from .hashing import DEFAULT_BCRYPT_POOL_WORKERS, DEFAULT_BCRYPT_ROUNDS
+from .utils import OrjsonProvider
 
-db = SQLAlchemy()
+
+db = SQLAlchemy(session_options={"autoflush": False})
 login_manager = LoginManager()
 bcrypt = Bcrypt()
 migrate = Migrate()
+cache = Cache()
+server_session = Session()
+
+# Imported after the extensions above exist; these modules pull them from the package.
+from . import models  # noqa: E402,F401  # ensure models are registered for migrations
+from .api import api_bp  # noqa: E402
+from .cli import register_cli  # noqa: E402
+from .views import pages_bp  # noqa: E402
+
+_BASE_DIR = Path(__file__).resolve().parent.parent
+_STATIC_DIR = str(_BASE_DIR / "static")
+_TEMPLATES_DIR = str(_BASE_DIR / "templates")
 
 
 def create_app(test_config: dict | None = None) -> Flask:
@@ -19,17 +38,31 @@ def create_app(test_config: dict | None = None) -> Flask:
     app = Flask(
         __name__,
         instance_relative_config=True,
-        static_folder=str(Path(__file__).resolve().parent.parent / "static"),
-        template_folder=str(Path(__file__).resolve().parent.parent / "templates"),
+        static_folder=_STATIC_DIR,
+        template_folder=_TEMPLATES_DIR,
     )
+    app.json = OrjsonProvider(app)
 
     default_db_path = Path(app.instance_path) / "app.db"
+    redis_url = os.environ.get("REDIS_URL")
     app.config.from_mapping(
         SECRET_KEY=os.environ.get("SECRET_KEY", "dev-secret"),
         SQLALCHEMY_DATABASE_URI=os.environ.get("DATABASE_URL", f"sqlite:///{default_db_path}"),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        BCRYPT_LOG_ROUNDS=int(os.environ.get("BCRYPT_ROUNDS", DEFAULT_BCRYPT_ROUNDS)),
+        # Per web worker; total bcrypt processes per host = gunicorn workers x this.
+        BCRYPT_POOL_WORKERS=int(os.environ.get("BCRYPT_POOL_WORKERS", DEFAULT_BCRYPT_POOL_WORKERS)),
+        CACHE_TYPE="RedisCache" if redis_url else "SimpleCache",
+        CACHE_REDIS_URL=redis_url,
+        CACHE_KEY_PREFIX="notecart:",
+        # Version counters must not expire; cached responses pass their own timeout.
+        CACHE_DEFAULT_TIMEOUT=0,
+        STATIC_MAX_AGE=int(os.environ.get("STATIC_MAX_AGE", "3600")),
         SESSION_COOKIE_HTTPONLY=True,
         SESSION_COOKIE_SAMESITE="Lax",
+        # With Redis available the cookie only carries a session id; otherwise Flask's signed cookie is used.
+        SESSION_TYPE="redis" if redis_url else None,
+        SESSION_PERMANENT=False,
     )
 
     if test_config:
@@ -37,18 +70,26 @@ def create_app(test_config: dict | None = None) -> Flask:
 
     Path(app.instance_path).mkdir(parents=True, exist_ok=True)
 
+    # Serve /static/* before the request reaches Flask, including precompressed .gz/.br files.
+    app.wsgi_app = WhiteNoise(
+        app.wsgi_app,
+        root=_STATIC_DIR,
+        prefix="static/",
+        autorefresh=app.debug,
+        max_age=app.config["STATIC_MAX_AGE"],
+    )
+
     db.init_app(app)
     login_manager.init_app(app)
     bcrypt.init_app(app)
+    cache.init_app(app)
+    if app.config["SESSION_TYPE"] == "redis":
+        app.config.setdefault("SESSION_REDIS", Redis.from_url(redis_url))
+        server_session.init_app(app)
     migrate.init_app(app, db)
 
     login_manager.login_view = "auth.login"
 
-    from . import models  # noqa: F401  # ensure models are registered for migrations
-    from .cli import register_cli
-    from .api import api_bp
-    from .views import pages_bp
-
     register_cli(app)
     app.register_blueprint(api_bp)
     app.register_blueprint(pages_bp)
@@ -2,15 +2,19 @@
 
 from __future__ import annotations
 
-import json
 from typing import Any
+from urllib.parse import urlencode
 
+import orjson
 from email_validator import EmailNotValidError, validate_email
 from flask import Blueprint, jsonify, request, session
 from flask_login import current_user, login_required, login_user, logout_user
+from sqlalchemy import bindparam, insert, lambda_stmt, select, update
+from sqlalchemy.orm import raiseload, selectinload
 
-from . import bcrypt, db
+from . import cache, db, hashing
 from .models import Feedback, Note, Order, OrderItem, Product, User
+from .search import match_filter
 from .utils import (
     add_to_cart,
     clear_cart,
@@ -20,10 +24,21 @@ from .utils import (
     serialize_note,
     serialize_order,
     serialize_user,
+    stream_json_list,
 )
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
 
+# Rows fetched (and eager-loaded) per round-trip by the streaming admin listings.
+_STREAM_BATCH_SIZE = 500
+
+# bcrypt only looks at the first 72 bytes; longer input is rejected before hashing.
+MAX_PASSWORD_BYTES = 72
+
+
+def _password_too_long(password: str) -> bool:
+    return len(password) > MAX_PASSWORD_BYTES or len(password.encode("utf-8")) > MAX_PASSWORD_BYTES
+
 
 def _payload() -> dict[str, Any]:
     if request.is_json:
@@ -56,6 +71,8 @@ def register_user():
 
     if len(password) < 8:
         errors["password"] = "Пароль должен быть не короче 8 символов"
+    elif _password_too_long(password):
+        errors["password"] = f"Пароль должен быть не длиннее {MAX_PASSWORD_BYTES} байт"
 
     if User.query.filter_by(email=email).first():
         errors["email"] = "Пользователь с таким email уже существует"
@@ -63,7 +80,7 @@ def register_user():
     if errors:
         return jsonify({"errors": errors}), 400
 
-    password_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+    password_hash = hashing.hash_password(password)
     user = User(email=email, password_hash=password_hash, name=name, phone=phone)
     db.session.add(user)
     db.session.commit()
@@ -78,8 +95,11 @@ def login():
     email = data.get("email", "").lower().strip()
     password = data.get("password", "")
 
+    if _password_too_long(password):
+        return jsonify({"error": "Неверный email или пароль"}), 401
+
     user = User.query.filter_by(email=email).first()
-    if not user or not bcrypt.check_password_hash(user.password_hash, password):
+    if not user or not hashing.check_user_password(user, password):
         return jsonify({"error": "Неверный email или пароль"}), 401
 
     login_user(user)
@@ -119,7 +139,7 @@ def update_preferences():
         pref_json = prefs
     else:
         try:
-            pref_json = json.dumps(prefs)
+            pref_json = orjson.dumps(prefs).decode("utf-8")
         except (TypeError, ValueError):
             return jsonify({"error": "Неверный формат настроек"}), 400
 
@@ -135,14 +155,20 @@ def change_password():
     current_password = data.get("current_password", "")
     new_password = data.get("new_password", "")
 
-    if not bcrypt.check_password_hash(current_user.password_hash, current_password):
+    if _password_too_long(current_password) or not hashing.check_user_password(
+        current_user, current_password
+    ):
         return jsonify({"error": "Текущий пароль неверен"}), 400
 
     if len(new_password) < 8:
         return jsonify({"error": "Новый пароль слишком короткий"}), 400
 
-    current_user.password_hash = bcrypt.generate_password_hash(new_password).decode("utf-8")
+    if _password_too_long(new_password):
+        return jsonify({"error": "Новый пароль слишком длинный"}), 400
+
+    current_user.password_hash = hashing.hash_password(new_password)
     db.session.commit()
+    hashing.forget_verified_passwords(current_user)
     return jsonify({"message": "Пароль обновлён"})
 
 
@@ -154,12 +180,14 @@ def change_password():
 @api_bp.get("/notes")
 @login_required
 def list_notes():
-    query = Note.query.filter_by(user_id=current_user.id).order_by(Note.updated_at.desc())
+    user_id = current_user.id
+    stmt = lambda_stmt(lambda: select(Note).where(Note.user_id == user_id))
     q = request.args.get("q")
     if q:
-        like = f"%{q}%"
-        query = query.filter((Note.title.ilike(like)) | (Note.content.ilike(like)) | (Note.tags.ilike(like)))
-    notes = [serialize_note(note) for note in query.all()]
+        condition = match_filter(Note, q)
+        stmt += lambda s: s.where(condition)
+    stmt += lambda s: s.order_by(Note.updated_at.desc(), Note.id.desc())
+    notes = [serialize_note(note) for note in db.session.scalars(stmt).all()]
     return jsonify({"notes": notes})
 
 
@@ -182,7 +210,7 @@ def create_note():
 @api_bp.put("/notes/<int:note_id>")
 @login_required
 def update_note(note_id: int):
-    note = Note.query.get_or_404(note_id)
+    note = db.get_or_404(Note, note_id)
     if note.user_id != current_user.id and current_user.role != "admin":
         return jsonify({"error": "Нет доступа"}), 403
 
@@ -197,7 +225,7 @@ def update_note(note_id: int):
 @api_bp.delete("/notes/<int:note_id>")
 @login_required
 def delete_note(note_id: int):
-    note = Note.query.get_or_404(note_id)
+    note = db.get_or_404(Note, note_id)
     if note.user_id != current_user.id and current_user.role != "admin":
         return jsonify({"error": "Нет доступа"}), 403
 
@@ -233,29 +261,33 @@ def submit_feedback():
 @api_bp.get("/feedback")
 @role_required("admin")
 def list_feedback():
-    entries = Feedback.query.order_by(Feedback.created_at.desc()).all()
-    return jsonify({"feedback": [serialize_feedback(item) for item in entries]})
+    stmt = (
+        select(Feedback)
+        .options(selectinload(Feedback.author))
+        .order_by(Feedback.created_at.desc(), Feedback.id.desc())
+        .execution_options(yield_per=_STREAM_BATCH_SIZE)
+    )
+    return stream_json_list("feedback", db.session.scalars(stmt).partitions(), serialize_feedback)
 
 
 @api_bp.get("/search")
 @login_required
 def search():
     term = request.args.get("q", "").strip()
-    like = f"%{term}%" if term else "%"
 
-    notes_query = Note.query.filter_by(user_id=current_user.id)
+    user_id = current_user.id
+    notes_stmt = lambda_stmt(lambda: select(Note).where(Note.user_id == user_id))
+    products_stmt = lambda_stmt(lambda: select(Product))
     if term:
-        notes_query = notes_query.filter(
-            (Note.title.ilike(like)) | (Note.content.ilike(like)) | (Note.tags.ilike(like))
-        )
-    notes = [serialize_note(n) for n in notes_query.limit(20).all()]
+        note_condition = match_filter(Note, term)
+        product_condition = match_filter(Product, term)
+        notes_stmt += lambda s: s.where(note_condition)
+        products_stmt += lambda s: s.where(product_condition)
+    notes_stmt += lambda s: s.limit(20)
+    products_stmt += lambda s: s.limit(20)
 
-    product_query = Product.query
-    if term:
-        product_query = product_query.filter(
-            (Product.name.ilike(like)) | (Product.description.ilike(like)) | (Product.tags.ilike(like))
-        )
-    products = [product.to_dict() for product in product_query.limit(20).all()]
+    notes = [serialize_note(n) for n in db.session.scalars(notes_stmt).all()]
+    products = [product.to_dict() for product in db.session.scalars(products_stmt).all()]
 
     return jsonify({"notes": notes, "products": products})
 
@@ -265,29 +297,92 @@ def search():
 # -----------------
 
 
+def _products_by_id(product_ids) -> dict[int, Product]:
+    """Load all requested products with a single IN query."""
+    ids = set(product_ids)
+    if not ids:
+        return {}
+    return {product.id: product for product in Product.query.filter(Product.id.in_(ids)).all()}
+
+
+# Listings go stale on any product change (including stock); cart snapshots only on name/price changes.
+_PRODUCTS_VERSION_KEY = "products:version"
+_PRICES_VERSION_KEY = "products:prices_version"
+_PRODUCTS_CACHE_TTL = 60
+
+
+def _catalog_version() -> int:
+    return cache.get(_PRODUCTS_VERSION_KEY) or 0
+
+
+def _prices_version() -> int:
+    return cache.get(_PRICES_VERSION_KEY) or 0
+
+
+def _products_cache_key() -> str:
+    # Bumping the version orphans every cached listing at once on any backend.
+    args = urlencode(sorted(request.args.items(multi=True)))
+    return f"products:{_catalog_version()}:{args}"
+
+
+def _bump_version(key: str) -> None:
+    # add() only seeds a missing key; the backend's inc() is an atomic INCR on RedisCache.
+    cache.add(key, 0, timeout=0)
+    cache.cache.inc(key)
+
+
+def invalidate_products_cache() -> None:
+    """Drop cached product listings, e.g. after stock changes."""
+    _bump_version(_PRODUCTS_VERSION_KEY)
+
+
+def invalidate_product_prices() -> None:
+    """Call after changing a product's name or price: also marks cart snapshots as stale."""
+    _bump_version(_PRICES_VERSION_KEY)
+    invalidate_products_cache()
+
+
+def _refresh_cart(cart: list[dict], version: int) -> list[dict]:
+    """Re-read names and prices for a cart whose snapshot predates ``version``."""
+    products = _products_by_id(item["product_id"] for item in cart)
+    refreshed = [
+        {
+            "product_id": product.id,
+            "quantity": item["quantity"],
+            "name": product.name,
+            "price": product.price,
+        }
+        for item in cart
+        if (product := products.get(item["product_id"]))
+    ]
+    session["cart"] = refreshed
+    session["cart_version"] = version
+    return refreshed
+
+
 @api_bp.get("/products")
+@cache.cached(timeout=_PRODUCTS_CACHE_TTL, make_cache_key=_products_cache_key)
 def list_products():
-    query = Product.query
+    stmt = lambda_stmt(lambda: select(Product))
     category = request.args.get("category")
     if category:
-        query = query.filter(Product.category == category)
+        stmt += lambda s: s.where(Product.category == category)
 
     search_term = request.args.get("q")
     if search_term:
-        like = f"%{search_term}%"
-        query = query.filter(
-            (Product.name.ilike(like)) | (Product.description.ilike(like)) | (Product.tags.ilike(like))
-        )
+        condition = match_filter(Product, search_term)
+        stmt += lambda s: s.where(condition)
 
     max_price = request.args.get("max_price")
     if max_price:
         try:
             price_value = float(max_price)
-            query = query.filter(Product.price <= price_value)
+            stmt += lambda s: s.where(Product.price <= price_value)
         except ValueError:
             pass
 
-    products = [product.to_dict() for product in query.order_by(Product.name).all()]
+    stmt += lambda s: s.order_by(Product.name)
+    products = [product.to_dict() for product in db.session.scalars(stmt).all()]
     return jsonify({"products": products})
 
 
@@ -295,17 +390,18 @@ def list_products():
 @login_required
 def get_cart_items():
     cart = get_cart()
+    version = _prices_version()
+    if cart and session.get("cart_version") != version:
+        cart = _refresh_cart(cart, version)
+
     detailed = []
     total = 0.0
     for item in cart:
-        product = Product.query.get(item["product_id"])
-        if not product:
-            continue
-        subtotal = product.price * item["quantity"]
+        subtotal = item["price"] * item["quantity"]
         total += subtotal
         detailed.append(
             {
-                "product": product.to_dict(),
+                "product": {"id": item["product_id"], "name": item["name"], "price": item["price"]},
                 "quantity": item["quantity"],
                 "subtotal": subtotal,
             }
@@ -326,11 +422,11 @@ def add_cart_item():
     if quantity <= 0:
         return jsonify({"error": "Количество должно быть положительным"}), 400
 
-    product = Product.query.get_or_404(product_id)
+    product = db.get_or_404(Product, product_id)
     if product.stock < quantity:
         return jsonify({"error": "Недостаточно товара на складе"}), 400
 
-    add_to_cart(product_id, quantity)
+    add_to_cart(product.id, quantity, name=product.name, price=product.price, version=_prices_version())
     return jsonify({"message": "Товар добавлен в корзину"})
 
 
@@ -353,6 +449,26 @@ def clear_cart_route():
     return jsonify({"message": "Корзина очищена"})
 
 
+def _reserve_stock(prepared_items: list[tuple[Product, int]]) -> bool:
+    """Decrement stock for every line, or report that some line no longer has enough."""
+    products_table = Product.__table__
+    # The stock guard keeps concurrent checkouts from overselling.
+    reserve_stock = (
+        update(products_table)
+        .where(products_table.c.id == bindparam("product_id"))
+        .where(products_table.c.stock >= bindparam("qty"))
+        .values(stock=products_table.c.stock - bindparam("qty"))
+    )
+    params = [{"product_id": product.id, "qty": qty} for product, qty in prepared_items]
+
+    if db.session.get_bind().dialect.supports_sane_multi_rowcount:
+        # One executemany UPDATE whose summed rowcount is reliable on this backend.
+        return db.session.execute(reserve_stock, params).rowcount == len(params)
+
+    # e.g. psycopg2 batch mode or MySQL: check each line's rowcount separately.
+    return all(db.session.execute(reserve_stock, line).rowcount == 1 for line in params)
+
+
 @api_bp.post("/checkout")
 @login_required
 def checkout():
@@ -360,37 +476,48 @@ def checkout():
     if not cart:
         return jsonify({"error": "Корзина пуста"}), 400
 
+    products = _products_by_id(item["product_id"] for item in cart)
     prepared_items: list[tuple[Product, int]] = []
     total = 0.0
+    prices_changed = False
     for item in cart:
-        product = Product.query.get(item["product_id"])
+        product = products.get(item["product_id"])
         if not product:
             continue
         qty = item["quantity"]
         if product.stock < qty:
             return jsonify({"error": f"Недостаточно товара: {product.name}"}), 400
+        prices_changed |= item.get("price") != product.price
         prepared_items.append((product, qty))
         total += product.price * qty
 
     if not prepared_items:
         return jsonify({"error": "Нет доступных товаров"}), 400
 
+    # Never charge a price the user has not seen: refresh the snapshot and let them re-confirm.
+    if prices_changed:
+        refreshed = _refresh_cart(cart, _prices_version())
+        new_total = sum(item["price"] * item["quantity"] for item in refreshed)
+        return jsonify({"error": "Цены изменились, проверьте корзину", "total": new_total}), 409
+
+    if not _reserve_stock(prepared_items):
+        db.session.rollback()
+        return jsonify({"error": "Недостаточно товара на складе"}), 409
+
     order = Order(user_id=current_user.id, total=total, status="paid")
     db.session.add(order)
-    db.session.flush()
-
-    for product, qty in prepared_items:
-        product.stock -= qty
-        db.session.add(
-            OrderItem(
-                order_id=order.id,
-                product_id=product.id,
-                quantity=qty,
-                price=product.price,
-            )
-        )
+    db.session.flush()  # autoflush is off; assign order.id before inserting items
+
+    db.session.execute(
+        insert(OrderItem),
+        [
+            {"order_id": order.id, "product_id": product.id, "quantity": qty, "price": product.price}
+            for product, qty in prepared_items
+        ],
+    )
 
     db.session.commit()
+    invalidate_products_cache()
     clear_cart()
     return jsonify({"message": "Заказ оформлен", "order": serialize_order(order)})
 
@@ -403,12 +530,24 @@ def checkout():
 @api_bp.get("/admin/users")
 @role_required("admin")
 def admin_users():
-    users = User.query.order_by(User.created_at.desc()).all()
-    return jsonify({"users": [serialize_user(u) for u in users]})
+    stmt = (
+        select(User)
+        .order_by(User.created_at.desc(), User.id.desc())
+        .execution_options(yield_per=_STREAM_BATCH_SIZE)
+    )
+    return stream_json_list("users", db.session.scalars(stmt).partitions(), serialize_user)
 
 
 @api_bp.get("/admin/orders")
 @role_required("admin")
 def admin_orders():
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return jsonify({"orders": [serialize_order(o) for o in orders]})
+    stmt = (
+        select(Order)
+        .options(
+            selectinload(Order.items).selectinload(OrderItem.product),
+            raiseload("*"),
+        )
+        .order_by(Order.created_at.desc(), Order.id.desc())
+        .execution_options(yield_per=_STREAM_BATCH_SIZE)
+    )
+    return stream_json_list("orders", db.session.scalars(stmt).partitions(), serialize_order)
@@ -2,9 +2,12 @@
 
 from __future__ import annotations
 
+import time
+
 import click
 
-from . import bcrypt, db
+from . import db
+from .hashing import _hash, hash_passwords
 from .models import Feedback, Note, Order, OrderItem, Product, User
 
 
@@ -13,9 +16,10 @@ def register_cli(app):
 
     @app.cli.command("init-db")
     def init_db_command():
-        """Create all database tables."""
+        """Create all database tables and any indexes missing from existing ones."""
         with app.app_context():
             db.create_all()
+            _create_missing_indexes()
         click.echo("Database tables created.")
 
     @app.cli.command("seed-db")
@@ -25,6 +29,34 @@ def register_cli(app):
             _seed_database()
         click.echo("Demo data inserted.")
 
+    @app.cli.command("calibrate-bcrypt")
+    @click.option("--target-ms", default=250, show_default=True, help="Desired time per hash.")
+    def calibrate_bcrypt_command(target_ms: int):
+        """Suggest a BCRYPT_ROUNDS value for this machine."""
+        rounds = _calibrate_bcrypt_rounds(target_ms / 1000)
+        click.echo(f"Recommended BCRYPT_ROUNDS={rounds}")
+
+
+def _create_missing_indexes():
+    # create_all skips tables that already exist, including indexes added to them later.
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+def _calibrate_bcrypt_rounds(target_seconds: float, min_rounds: int = 4, max_rounds: int = 16) -> int:
+    """Return the highest cost whose hash time stays within the target."""
+    best = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        started = time.perf_counter()
+        _hash(b"calibration-password", rounds)  # same function the hashing pool runs
+        elapsed = time.perf_counter() - started
+        click.echo(f"rounds={rounds}: {elapsed * 1000:.1f} ms")
+        if elapsed > target_seconds:
+            break
+        best = rounds
+    return best
+
 
 def _seed_database():
     # Ensure tables exist
@@ -34,9 +66,10 @@ def _seed_database():
         click.echo("Database already has data; skipping seeding.")
         return
 
+    admin_hash, user_hash = hash_passwords(["Admin123!", "User123!"])
     admin = User(
         email="admin@example.com",
-        password_hash=bcrypt.generate_password_hash("Admin123!").decode("utf-8"),
+        password_hash=admin_hash,
         role="admin",
         name="Администратор",
         phone="+7 999 000 00 00",
@@ -44,13 +77,14 @@ def _seed_database():
     )
     user = User(
         email="user@example.com",
-        password_hash=bcrypt.generate_password_hash("User123!").decode("utf-8"),
+        password_hash=user_hash,
         role="user",
         name="Мария",
         phone="+7 999 111 22 33",
         preferences="{\"theme\": \"light\", \"language\": \"ru\"}",
     )
     db.session.add_all([admin, user])
+    # The session does not autoflush; flush explicitly wherever new ids are needed below.
     db.session.flush()
 
     notes = [
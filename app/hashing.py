@@ -0,0 +1,142 @@
+"""Password hashing that runs bcrypt in a shared process pool."""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Any, Callable, Iterable
+
+import bcrypt as _bcrypt
+from flask import current_app
+
+if TYPE_CHECKING:
+    from .models import User
+
+DEFAULT_BCRYPT_ROUNDS = 10
+DEFAULT_BCRYPT_POOL_WORKERS = min(4, os.cpu_count() or 1)
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # forkserver children start from a clean process instead of forking a
+                # threaded web worker along with its connections and held locks.
+                _pool = ProcessPoolExecutor(
+                    max_workers=current_app.config.get("BCRYPT_POOL_WORKERS", DEFAULT_BCRYPT_POOL_WORKERS),
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+    return _pool
+
+
+def _discard_pool(broken: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        # Another thread may already have replaced it.
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(fn: Callable[..., Any], calls: list[tuple]) -> list[Any]:
+    """Run ``fn`` over ``calls`` in the pool, recreating it once if a worker died."""
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            futures = [pool.submit(fn, *args) for args in calls]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            if attempt:
+                raise
+    raise AssertionError("unreachable")
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return _bcrypt.hashpw(password, _bcrypt.gensalt(rounds))
+
+
+def _verify(password: bytes, password_hash: bytes) -> bool:
+    return _bcrypt.checkpw(password, password_hash)
+
+
+def _rounds() -> int:
+    return current_app.config.get("BCRYPT_LOG_ROUNDS", DEFAULT_BCRYPT_ROUNDS)
+
+
+def hash_password(password: str) -> str:
+    """Hash a password with the configured bcrypt cost."""
+    if not password:
+        raise ValueError("Password must be non-empty.")
+    [password_hash] = _run(_hash, [(password.encode("utf-8"), _rounds())])
+    return password_hash.decode("utf-8")
+
+
+def hash_passwords(passwords: Iterable[str]) -> list[str]:
+    """Hash several passwords in parallel, preserving order."""
+    encoded = [password.encode("utf-8") for password in passwords]
+    if not all(encoded):
+        raise ValueError("Password must be non-empty.")
+    rounds = _rounds()
+    hashes = _run(_hash, [(password, rounds) for password in encoded])
+    return [password_hash.decode("utf-8") for password_hash in hashes]
+
+
+def verify_password(password_hash: str, password: str) -> bool:
+    """Check a password against a stored bcrypt hash."""
+    [matches] = _run(_verify, [(password.encode("utf-8"), password_hash.encode("utf-8"))])
+    return matches
+
+
+# Recent successful bcrypt checks, keyed by (user_id, HMAC of the password).
+_VERIFY_CACHE_SIZE = 4096
+_VERIFY_CACHE_TTL = 300
+_verified_passwords: OrderedDict[tuple[int, str], float] = OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def _password_digest(user: User, password: str) -> str:
+    secret = current_app.secret_key
+    if isinstance(secret, str):
+        secret = secret.encode("utf-8")
+    message = f"{user.id}:{user.password_hash}:{password}".encode("utf-8")
+    return hmac.new(secret, message, hashlib.sha256).hexdigest()
+
+
+def check_user_password(user: User, password: str) -> bool:
+    """Check a password, skipping bcrypt if it was verified recently."""
+    key = (user.id, _password_digest(user, password))
+    now = time.monotonic()
+    with _verified_lock:
+        expires = _verified_passwords.get(key)
+        if expires is not None and expires > now:
+            _verified_passwords.move_to_end(key)
+            return True
+
+    if not verify_password(user.password_hash, password):
+        return False
+
+    with _verified_lock:
+        _verified_passwords[key] = now + _VERIFY_CACHE_TTL
+        _verified_passwords.move_to_end(key)
+        while len(_verified_passwords) > _VERIFY_CACHE_SIZE:
+            _verified_passwords.popitem(last=False)
+    return True
+
+
+def forget_verified_passwords(user: User) -> None:
+    """Drop cached checks for ``user``, e.g. after a password change."""
+    with _verified_lock:
+        for key in [key for key in _verified_passwords if key[0] == user.id]:
+            del _verified_passwords[key]
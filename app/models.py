@@ -1,7 +1,7 @@
-from datetime import datetime
 from typing import Optional
 
 from flask_login import UserMixin
+from sqlalchemy.sql import func
 
 from . import db, login_manager
 
@@ -16,8 +16,8 @@ class User(db.Model, UserMixin):
     name = db.Column(db.String(120))
     phone = db.Column(db.String(40))
     preferences = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=func.now(), server_default=func.now())
+    updated_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), onupdate=func.now())
 
     notes = db.relationship("Note", backref="author", lazy=True)
     feedback_entries = db.relationship("Feedback", backref="author", lazy=True)
@@ -29,13 +29,14 @@ class User(db.Model, UserMixin):
 
 class Note(db.Model):
     __tablename__ = "notes"
+    __table_args__ = (db.Index("ix_notes_user_updated", "user_id", "updated_at"),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     tags = db.Column(db.String(200))
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=func.now(), server_default=func.now(), onupdate=func.now())
 
 
 class Feedback(db.Model):
@@ -45,11 +46,12 @@ class Feedback(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     message = db.Column(db.Text, nullable=False)
     rating = db.Column(db.Integer)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=func.now(), server_default=func.now())
 
 
 class Product(db.Model):
     __tablename__ = "products"
+    __table_args__ = (db.Index("ix_products_category", "category"),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -73,12 +75,16 @@ class Product(db.Model):
 
 class Order(db.Model):
     __tablename__ = "orders"
+    __table_args__ = (
+        db.Index("ix_orders_user_created", "user_id", "created_at"),
+        db.Index("ix_orders_created", "created_at"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     total = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(40), default="pending")
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=func.now(), server_default=func.now())
 
     items = db.relationship("OrderItem", backref="order", lazy=True, cascade="all, delete-orphan")
 
@@ -0,0 +1,89 @@
+"""Full-text search over notes and products backed by SQLite FTS5."""
+
+from __future__ import annotations
+
+import re
+
+from sqlalchemy import Integer, column, event, or_, text
+
+from . import db
+
+# Indexed table -> searchable columns. Each gets a "<table>_fts" shadow index.
+_FTS_COLUMNS = {
+    "notes": ("title", "content", "tags"),
+    "products": ("name", "description", "tags"),
+}
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+# (engine url, fts table) pairs already confirmed to exist.
+_ready_indexes: set[tuple[str, str]] = set()
+
+
+def _index_ddl(table: str, columns: tuple[str, ...]) -> list[str]:
+    fts = f"{table}_fts"
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{name}" for name in columns)
+    old = ", ".join(f"old.{name}" for name in columns)
+    delete_old = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+    insert_new = f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN {delete_old} END",
+        # Only re-index when a searchable column changes (e.g. not on product stock updates).
+        f"DROP TRIGGER IF EXISTS {table}_fts_au",
+        f"CREATE TRIGGER {table}_fts_au AFTER UPDATE OF {cols} ON {table} BEGIN {delete_old} {insert_new} END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+@event.listens_for(db.metadata, "after_create")
+def install_search_indexes(target, connection, **kw) -> None:
+    """Create (or rebuild) the FTS5 indexes once the base tables exist."""
+    if connection.dialect.name != "sqlite":
+        return
+    for table, columns in _FTS_COLUMNS.items():
+        for statement in _index_ddl(table, columns):
+            connection.exec_driver_sql(statement)
+
+
+@event.listens_for(db.metadata, "before_drop")
+def drop_search_indexes(target, connection, **kw) -> None:
+    if connection.dialect.name != "sqlite":
+        return
+    for table in _FTS_COLUMNS:
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {table}_fts")
+        _ready_indexes.discard((str(connection.engine.url), f"{table}_fts"))
+
+
+def _has_index(fts: str) -> bool:
+    key = (str(db.engine.url), fts)
+    if key in _ready_indexes:
+        return True
+    exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": fts}
+    ).first()
+    if exists:
+        _ready_indexes.add(key)
+    return exists is not None
+
+
+def match_filter(model, term: str):
+    """Build a WHERE clause matching ``term`` against the model's search columns.
+
+    On SQLite every word of the term is matched as a prefix through the FTS5
+    index; other databases, and SQLite files that predate the index (until
+    ``flask init-db`` is run), fall back to case-insensitive substring matching.
+    """
+    columns = _FTS_COLUMNS[model.__tablename__]
+    tokens = _TOKEN_RE.findall(term)
+    fts = f"{model.__tablename__}_fts"
+    if tokens and db.engine.dialect.name == "sqlite" and _has_index(fts):
+        match = " ".join(f'"{token}"*' for token in tokens)
+        rowids = text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :match").bindparams(match=match)
+        return model.id.in_(rowids.columns(column("rowid", Integer)))
+
+    like = f"%{term}%"
+    return or_(*(getattr(model, name).ilike(like) for name in columns))
@@ -3,12 +3,32 @@
 from __future__ import annotations
 
 from functools import wraps
-from typing import Callable
+from typing import Any, Callable, Iterable
 
-from flask import abort, session
+import orjson
+from flask import Response, abort, session, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_login import current_user, login_required
 
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes with orjson and writes bytes straight into responses."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=self.default).decode("utf-8")
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        option = orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        body = orjson.dumps(obj, default=self.default, option=option)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
 def role_required(*roles: str) -> Callable:
     """Ensure the current user has one of the required roles."""
 
@@ -79,11 +99,29 @@ def serialize_order(order) -> dict:
     }
 
 
+def stream_json_list(key: str, batches: Iterable[Iterable[Any]], serialize: Callable[[Any], dict]) -> Response:
+    """Stream ``{"<key>": [...]}`` one batch of rows at a time instead of building the whole list."""
+
+    def generate():
+        yield b"{" + orjson.dumps(key) + b":["
+        first = True
+        for batch in batches:
+            chunk = b",".join(orjson.dumps(serialize(row)) for row in batch)
+            if not chunk:
+                continue
+            yield chunk if first else b"," + chunk
+            first = False
+        yield b"]}\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
 def get_cart() -> list[dict]:
-    cart = session.get("cart", [])
+    cart = session.get("cart")
     if not isinstance(cart, list):
+        # Only write back when repairing, so read-only requests leave the session clean.
         cart = []
-    session["cart"] = cart
+        session["cart"] = cart
     return cart
 
 
@@ -91,12 +129,21 @@ def clear_cart() -> None:
     session["cart"] = []
 
 
-def add_to_cart(product_id: int, quantity: int = 1) -> None:
+def add_to_cart(product_id: int, quantity: int = 1, *, name: str, price: float, version: int) -> None:
+    """Add a product, keeping a name/price snapshot so the cart renders without DB reads.
+
+    ``cart_version`` records the price version of the oldest snapshot in the
+    cart; it is only set when the cart starts empty.
+    """
     cart = get_cart()
+    if not cart:
+        session["cart_version"] = version
     for item in cart:
         if item["product_id"] == product_id:
             item["quantity"] += quantity
+            item["name"] = name
+            item["price"] = price
             break
     else:
-        cart.append({"product_id": product_id, "quantity": quantity})
+        cart.append({"product_id": product_id, "quantity": quantity, "name": name, "price": price})
     session.modified = True
\ No newline at end of file
@@ -15,6 +15,7 @@ def app():
             "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
             "SECRET_KEY": "test-secret",
             "WTF_CSRF_ENABLED": False,
+            "BCRYPT_LOG_ROUNDS": 4,
         }
     )
 
@@ -174,6 +175,11 @@ def test_checkout(client, app):
     response = client.post("/api/checkout")
     assert response.status_code == 200
     assert response.json["message"] == "Заказ оформлен"
+    assert response.json["order"]["items"][0]["quantity"] == 1
+    assert response.json["order"]["items"][0]["product_name"] == "Checkout Product"
+
+    with app.app_context():
+        assert db.session.get(Product, product_id).stock == 4
 
 
 def test_admin_access(client, app):
@@ -198,3 +204,437 @@ def test_admin_access(client, app):
     response = client.get("/api/admin/users")
     assert response.status_code == 200
     assert "users" in response.json
+
+
+def test_calibrate_bcrypt(runner):
+    """Calibration command reports a recommended cost."""
+    result = runner.invoke(args=["calibrate-bcrypt", "--target-ms", "1"])
+    assert result.exit_code == 0
+    assert "Recommended BCRYPT_ROUNDS=" in result.output
+
+
+def test_change_password_invalidates_old_password(client, app):
+    """Old password must stop working after a change, even if verified recently."""
+    with app.app_context():
+        from app import bcrypt
+
+        user = User(
+            email="pw@example.com",
+            password_hash=bcrypt.generate_password_hash("OldPass123").decode("utf-8"),
+        )
+        db.session.add(user)
+        db.session.commit()
+
+    credentials = {"email": "pw@example.com", "password": "OldPass123"}
+    assert client.post("/api/auth/login", json=credentials).status_code == 200
+    assert client.post("/api/auth/login", json=credentials).status_code == 200
+
+    response = client.put(
+        "/api/auth/password",
+        json={"current_password": "OldPass123", "new_password": "NewPass123"},
+    )
+    assert response.status_code == 200
+
+    assert client.post("/api/auth/login", json=credentials).status_code == 401
+    assert (
+        client.post(
+            "/api/auth/login", json={"email": "pw@example.com", "password": "NewPass123"}
+        ).status_code
+        == 200
+    )
+
+
+def test_search_notes(client, app):
+    """Note search matches word prefixes and follows edits."""
+    with app.app_context():
+        from app import bcrypt
+
+        user = User(
+            email="search@example.com",
+            password_hash=bcrypt.generate_password_hash("Pass123").decode("utf-8"),
+        )
+        db.session.add(user)
+        db.session.commit()
+
+    client.post(
+        "/api/auth/login", json={"email": "search@example.com", "password": "Pass123"}
+    )
+    created = client.post(
+        "/api/notes", json={"title": "Список покупок", "content": "Молоко, хлеб"}
+    )
+    client.post("/api/notes", json={"title": "План", "content": "Релиз"})
+
+    response = client.get("/api/notes", query_string={"q": "молок"})
+    assert [n["title"] for n in response.json["notes"]] == ["Список покупок"]
+
+    note_id = created.json["note"]["id"]
+    client.put(f"/api/notes/{note_id}", json={"content": "Кефир"})
+    assert client.get("/api/notes", query_string={"q": "молок"}).json["notes"] == []
+    assert len(client.get("/api/search", query_string={"q": "кефир"}).json["notes"]) == 1
+
+
+def test_admin_orders_query_count(client, app):
+    """Admin order listing uses a fixed number of queries regardless of order count."""
+    from sqlalchemy import event
+
+    with app.app_context():
+        from app import bcrypt
+        from app.models import Order, OrderItem, Product
+
+        admin = User(
+            email="orders@test.com",
+            password_hash=bcrypt.generate_password_hash("Admin123").decode("utf-8"),
+            role="admin",
+        )
+        products = [Product(name=f"Product {i}", price=10.0, stock=10) for i in range(3)]
+        db.session.add_all([admin, *products])
+        db.session.flush()
+        for _ in range(5):
+            order = Order(user_id=admin.id, total=30.0)
+            order.items = [
+                OrderItem(product_id=product.id, quantity=1, price=10.0) for product in products
+            ]
+            db.session.add(order)
+        db.session.commit()
+        engine = db.engine
+
+    client.post(
+        "/api/auth/login", json={"email": "orders@test.com", "password": "Admin123"}
+    )
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = client.get("/api/admin/orders")
+        orders = response.json["orders"]  # the body is streamed, so read it while counting
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert response.status_code == 200
+    assert len(orders) == 5
+    assert all(len(order["items"]) == 3 for order in orders)
+    # orders + order_items + products
+    assert len(statements) == 3
+
+
+def test_products_cache_refreshes_after_checkout(client, app):
+    """Cached product listing reflects stock changes made by checkout."""
+    with app.app_context():
+        from app import bcrypt
+        from app.models import Product
+
+        user = User(
+            email="cache@example.com",
+            password_hash=bcrypt.generate_password_hash("Pass123").decode("utf-8"),
+        )
+        product = Product(name="Cached Product", price=10.0, stock=3, category="Test")
+        db.session.add_all([user, product])
+        db.session.commit()
+        product_id = product.id
+
+    assert client.get("/api/products").json["products"][0]["stock"] == 3
+
+    client.post(
+        "/api/auth/login", json={"email": "cache@example.com", "password": "Pass123"}
+    )
+    client.post("/api/cart", json={"product_id": product_id, "quantity": 2})
+    assert client.post("/api/checkout").status_code == 200
+
+    assert client.get("/api/products").json["products"][0]["stock"] == 1
+
+
+def test_cart_uses_snapshot_until_catalog_changes(client, app):
+    """Cart view serves stored prices and refreshes them once product prices are invalidated."""
+    with app.app_context():
+        from app import bcrypt
+        from app.api import invalidate_product_prices
+        from app.models import Product
+
+        user = User(
+            email="snapshot@example.com",
+            password_hash=bcrypt.generate_password_hash("Pass123").decode("utf-8"),
+        )
+        product = Product(name="Snapshot Product", price=20.0, stock=10)
+        db.session.add_all([user, product])
+        db.session.commit()
+        product_id = product.id
+
+    client.post(
+        "/api/auth/login", json={"email": "snapshot@example.com", "password": "Pass123"}
+    )
+    client.post("/api/cart", json={"product_id": product_id, "quantity": 2})
+
+    with app.app_context():
+        db.session.get(Product, product_id).price = 25.0
+        db.session.commit()
+
+    response = client.get("/api/cart")
+    assert response.json["items"][0]["product"]["name"] == "Snapshot Product"
+    assert response.json["total"] == 40.0
+
+    with app.app_context():
+        invalidate_product_prices()
+
+    assert client.get("/api/cart").json["total"] == 50.0
+
+
+def test_static_assets_served_with_cache_headers(client, app):
+    """Static files are served by WhiteNoise with a Cache-Control header."""
+    response = client.get("/static/css/main.css")
+    assert response.status_code == 200
+    assert f"max-age={app.config['STATIC_MAX_AGE']}" in response.headers["Cache-Control"]
+
+
+def test_register_rejects_overlong_password(client):
+    """Passwords beyond bcrypt's 72-byte limit are rejected without hashing."""
+    response = client.post(
+        "/api/auth/register",
+        json={"email": "long@example.com", "password": "п" * 40},
+    )
+    assert response.status_code == 400
+    assert "password" in response.json["errors"]
+
+    response = client.post(
+        "/api/auth/login", json={"email": "long@example.com", "password": "x" * 10_000}
+    )
+    assert response.status_code == 401
+
+
+def test_viewing_cart_does_not_rewrite_session(client, app):
+    """A plain cart read must not mark the session dirty and re-send the cookie."""
+    with app.app_context():
+        from app import bcrypt
+        from app.models import Product
+
+        user = User(
+            email="readonly@example.com",
+            password_hash=bcrypt.generate_password_hash("Pass123").decode("utf-8"),
+        )
+        product = Product(name="Read Product", price=5.0, stock=5)
+        db.session.add_all([user, product])
+        db.session.commit()
+        product_id = product.id
+
+    client.post(
+        "/api/auth/login", json={"email": "readonly@example.com", "password": "Pass123"}
+    )
+    client.post("/api/cart", json={"product_id": product_id, "quantity": 1})
+
+    response = client.get("/api/cart")
+    assert response.json["total"] == 5.0
+    assert "Set-Cookie" not in response.headers
+
+
+def test_hashing_recovers_from_dead_pool_worker(app):
+    """A killed bcrypt worker must not leave hashing broken for the process."""
+    from app import hashing
+
+    password_hash = hashing.hash_password("Recover123")
+    for process in list(hashing._pool._processes.values()):
+        process.kill()
+        process.join()
+
+    assert hashing.verify_password(password_hash, "Recover123")
+    assert hashing.hash_password("Recover123").startswith("$2b$")
+    # The replacement pool honours the worker cap and does not fork the web process.
+    assert hashing._pool._max_workers == app.config["BCRYPT_POOL_WORKERS"]
+    assert hashing._pool._mp_context.get_start_method() == "forkserver"
+
+
+def test_init_db_adds_missing_indexes(app, runner):
+    """init-db upgrades a database whose tables predate the listing indexes."""
+    from sqlalchemy import inspect
+
+    with app.app_context():
+        db.session.execute(db.text("DROP INDEX ix_notes_user_updated"))
+        db.session.commit()
+
+    result = runner.invoke(args=["init-db"])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        names = {index["name"] for index in inspect(db.engine).get_indexes("notes")}
+    assert "ix_notes_user_updated" in names
+
+
+def test_checkout_conflict_when_stock_runs_out(client, app, monkeypatch):
+    """Stock sold between the in-memory check and the guarded UPDATE yields 409 and no order."""
+    from app import api
+    from app.models import Order, Product
+
+    with app.app_context():
+        from app import bcrypt
+
+        user = User(
+            email="race@example.com",
+            password_hash=bcrypt.generate_password_hash("Pass123").decode("utf-8"),
+        )
+        product = Product(name="Race Product", price=10.0, stock=2)
+        db.session.add_all([user, product])
+        db.session.commit()
+        product_id = product.id
+
+    client.post(
+        "/api/auth/login", json={"email": "race@example.com", "password": "Pass123"}
+    )
+    client.post("/api/cart", json={"product_id": product_id, "quantity": 2})
+
+    with app.app_context():
+        # Another checkout takes the last units.
+        db.session.execute(db.update(Product).where(Product.id == product_id).values(stock=1))
+        db.session.commit()
+
+    real_products_by_id = api._products_by_id
+
+    def stale_products_by_id(product_ids):
+        products = real_products_by_id(product_ids)
+        for product in products.values():
+            product.stock = 2  # what this request saw before the other checkout committed
+        return products
+
+    monkeypatch.setattr(api, "_products_by_id", stale_products_by_id)
+
+    response = client.post("/api/checkout")
+    assert response.status_code == 409
+
+    with app.app_context():
+        db.session.expire_all()
+        assert db.session.get(Product, product_id).stock == 1
+        assert db.session.query(Order).count() == 0
+
+
+def test_other_users_checkout_keeps_cart_snapshot(app):
+    """Another user's checkout changes stock only, so a cart read stays DB-free and cookie-free."""
+    from sqlalchemy import event
+
+    with app.app_context():
+        from app import bcrypt
+        from app.models import Product
+
+        password_hash = bcrypt.generate_password_hash("Pass123").decode("utf-8")
+        db.session.add_all(
+            [
+                User(email="alice@example.com", password_hash=password_hash),
+                User(email="bob@example.com", password_hash=password_hash),
+            ]
+        )
+        product = Product(name="Shared Product", price=15.0, stock=10)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+        engine = db.engine
+
+    alice, bob = app.test_client(), app.test_client()
+    for client, email in ((alice, "alice@example.com"), (bob, "bob@example.com")):
+        client.post("/api/auth/login", json={"email": email, "password": "Pass123"})
+        client.post("/api/cart", json={"product_id": product_id, "quantity": 1})
+
+    assert bob.post("/api/checkout").status_code == 200
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = alice.get("/api/cart")
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert response.json["total"] == 15.0
+    assert "Set-Cookie" not in response.headers
+    assert not [s for s in statements if "FROM products" in s]
+
+
+def test_notes_written_in_same_second_are_newest_first(client, app):
+    """Second-resolution timestamps tie; the id tie-breaker keeps the newest note first."""
+    with app.app_context():
+        from app import bcrypt
+
+        user = User(
+            email="ties@example.com",
+            password_hash=bcrypt.generate_password_hash("Pass123").decode("utf-8"),
+        )
+        db.session.add(user)
+        db.session.commit()
+
+    client.post("/api/auth/login", json={"email": "ties@example.com", "password": "Pass123"})
+    for title in ("first", "second", "third"):
+        client.post("/api/notes", json={"title": title, "content": "same second"})
+
+    titles = [note["title"] for note in client.get("/api/notes").json["notes"]]
+    assert titles == ["third", "second", "first"]
+
+
+def test_checkout_without_sane_multi_rowcount(client, app, monkeypatch):
+    """Backends that cannot sum executemany rowcounts reserve stock line by line."""
+    with app.app_context():
+        from app import bcrypt
+        from app.models import Product
+
+        user = User(
+            email="rowcount@example.com",
+            password_hash=bcrypt.generate_password_hash("Pass123").decode("utf-8"),
+        )
+        products = [Product(name=f"Line {i}", price=10.0, stock=3) for i in range(2)]
+        db.session.add_all([user, *products])
+        db.session.commit()
+        product_ids = [product.id for product in products]
+        monkeypatch.setattr(db.engine.dialect, "supports_sane_multi_rowcount", False)
+
+    client.post(
+        "/api/auth/login", json={"email": "rowcount@example.com", "password": "Pass123"}
+    )
+    for product_id in product_ids:
+        client.post("/api/cart", json={"product_id": product_id, "quantity": 2})
+
+    assert client.post("/api/checkout").status_code == 200
+
+    with app.app_context():
+        db.session.expire_all()
+        assert [db.session.get(Product, pid).stock for pid in product_ids] == [1, 1]
+
+
+def test_checkout_rejects_stale_cart_prices(client, app):
+    """A price change after add-to-cart is surfaced before the user is charged."""
+    from app.models import Order, Product
+
+    with app.app_context():
+        from app import bcrypt
+
+        user = User(
+            email="stale@example.com",
+            password_hash=bcrypt.generate_password_hash("Pass123").decode("utf-8"),
+        )
+        product = Product(name="Repriced Product", price=5.0, stock=10)
+        db.session.add_all([user, product])
+        db.session.commit()
+        product_id = product.id
+
+    client.post(
+        "/api/auth/login", json={"email": "stale@example.com", "password": "Pass123"}
+    )
+    client.post("/api/cart", json={"product_id": product_id, "quantity": 2})
+
+    with app.app_context():
+        db.session.get(Product, product_id).price = 100.0
+        db.session.commit()
+
+    response = client.post("/api/checkout")
+    assert response.status_code == 409
+    assert response.json["total"] == 200.0
+
+    with app.app_context():
+        db.session.expire_all()
+        assert db.session.get(Product, product_id).stock == 10
+        assert db.session.query(Order).count() == 0
+
+    assert client.get("/api/cart").json["total"] == 200.0
+    response = client.post("/api/checkout")
+    assert response.status_code == 200
+    assert response.json["order"]["total"] == 200.0